@@ -25,6 +25,14 @@ AWS_SECRET_KEY = os.getenv("AWS_SECRET_KEY")
 S3_REGION = os.getenv("S3_REGION")
 S3_URL = f"https://{S3_BUCKET_NAME}.s3.{S3_REGION}.amazonaws.com"
 
+# Image processing limits
+IMAGE_PROCESSING_CONCURRENCY = int(os.getenv("IMAGE_PROCESSING_CONCURRENCY", os.cpu_count() or 1))
+IMAGE_QUEUE_TIMEOUT = int(os.getenv("IMAGE_QUEUE_TIMEOUT", 15))
+
+# Redis Configuration
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", 0.25))  # Seconds, for connecting and for each command
+
 # Build the database URL
 DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
@@ -9,7 +9,7 @@ class ChallengeBase(SQLModel):
     emoji: str = Field(max_length=10)
     category: str = Field(max_length=100)
     start_date: datetime
-    end_date: datetime
+    end_date: datetime = Field(index=True)
     duration: Optional[int] = 30  # How long users should spend doing the activity (in minutes)
     lifetime: Optional[int] = 48  # How long the challenge is open (in hours)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -1,4 +1,5 @@
 from sqlmodel import SQLModel, Field
+from sqlalchemy import Index
 from typing import Optional
 from datetime import datetime, timezone
 from enum import Enum
@@ -19,6 +20,11 @@ class ChallengeInvitationBase(SQLModel):
 class ChallengeInvitation(ChallengeInvitationBase, table=True):
     invitation_id: Optional[int] = Field(default=None, primary_key=True)
 
+    # Participants of a challenge are looked up by (challenge_id, status)
+    __table_args__ = (
+        Index("ix_challengeinvitation_challenge_status", "challenge_id", "status"),
+    )
+
     class Config:
         sa_column_kwargs = {
             "challenge_id,receiver_id": {"unique": True}  # One invitation per user per challenge
@@ -1,4 +1,5 @@
 from sqlmodel import SQLModel, Field
+from sqlalchemy import Index
 from typing import Optional
 from datetime import datetime, timezone
 from enum import Enum
@@ -9,14 +10,21 @@ class RequestStatus(str, Enum):
     REJECTED = "rejected"
 
 class FriendRequestBase(SQLModel):
-    sender_id: int = Field(foreign_key="user.user_id", index=True)
-    receiver_id: int = Field(foreign_key="user.user_id", index=True)
+    sender_id: int = Field(foreign_key="user.user_id")
+    receiver_id: int = Field(foreign_key="user.user_id")
     status: RequestStatus = Field(default=RequestStatus.PENDING)
     sent_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class FriendRequest(FriendRequestBase, table=True):
     request_id: Optional[int] = Field(default=None, primary_key=True)
 
+    # Covering indexes for pair lookups in either direction (InnoDB appends request_id).
+    # They also serve lookups by sender or receiver alone, so those columns need no index of their own.
+    __table_args__ = (
+        Index("ix_friendrequest_sender_receiver", "sender_id", "receiver_id", "status"),
+        Index("ix_friendrequest_receiver_sender", "receiver_id", "sender_id", "status"),
+    )
+
     # Ensure unique friend requests regardless of order
     class Config:
         table_name = "friend_requests"
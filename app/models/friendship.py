@@ -1,15 +1,22 @@
 from sqlmodel import SQLModel, Field
+from sqlalchemy import Index
 from typing import Optional
 from datetime import datetime, timezone
 
 class FriendshipBase(SQLModel):
-    user1_id: int = Field(foreign_key="user.user_id", index=True)
-    user2_id: int = Field(foreign_key="user.user_id", index=True)
+    user1_id: int = Field(foreign_key="user.user_id")
+    user2_id: int = Field(foreign_key="user.user_id")
     since: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class Friendship(FriendshipBase, table=True):
     friendship_id: Optional[int] = Field(default=None, primary_key=True)
 
+    # Indexes for pair lookups in either direction, which also serve lookups by either user alone
+    __table_args__ = (
+        Index("ix_friendship_user1_user2", "user1_id", "user2_id"),
+        Index("ix_friendship_user2_user1", "user2_id", "user1_id"),
+    )
+
     # Ensure unique friendships regardless of order
     class Config:
         table_name = "friendships"
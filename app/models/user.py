@@ -1,6 +1,7 @@
 from sqlmodel import SQLModel, Field
+from sqlalchemy import Index
 from typing import Optional
-from datetime import datetime, timezone
+from datetime import datetime, date, timezone
 
 class UserBase(SQLModel):
     username: str = Field(index=True, unique=True, max_length=15)
@@ -14,6 +15,17 @@ class UserBase(SQLModel):
 class User(UserBase, table=True):
     user_id: Optional[int] = Field(default=None, primary_key=True)
 
+    # Submission stats, kept up to date when submissions are created or deleted
+    total_challenges_completed: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    current_streak: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    last_submission_date: Optional[date] = None
+
+    # Full-text index used by user search, the ngram parser allows substring matches.
+    # Build it with innodb_ft_enable_stopword=OFF, otherwise ngrams containing stopwords (e.g. "a") are skipped.
+    __table_args__ = (
+        Index("ix_user_search", "username", "display_name", mysql_prefix="FULLTEXT", mysql_with_parser="ngram"),
+    )
+
 class UserPublic(SQLModel):
     user_id: int
     display_name: str
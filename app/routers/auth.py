@@ -1,5 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlmodel import Session, select
+from sqlmodel import Session, select, update
+from sqlalchemy import exists
+from sqlalchemy.exc import IntegrityError
 from pydantic import BaseModel
 from datetime import timedelta
 from typing import Optional
@@ -9,6 +11,7 @@ import secrets
 
 from ..services.auth import create_token, verify_token, normalize_username, validate_username, get_current_user_id
 from ..services.database import get_session
+from ..services.cache import bump_version, user_me_version_key
 from ..models.user import User, UserPublic
 from ..models.device import Device
 from ..config import ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_DAYS, FIREBASE_CREDENTIALS_JSON
@@ -36,7 +39,7 @@ def create_tokens(user_id: int):
 def generate_username(first_name: str, last_name: str) -> str:
     first_name = normalize_username(first_name)
     last_name = normalize_username(last_name) if last_name else ""
-    random_numbers = "".join([str(secrets.randbelow(10)) for _ in range(4)])
+    random_numbers = f"{secrets.randbelow(10_000):04d}"
     
     if last_name:
         # username format: f_lastname1234
@@ -94,7 +97,7 @@ async def google_auth(request: GoogleAuthRequest, db: Session = Depends(get_sess
             username = generate_username(first_name, last_name)
             
             # Ensure username is unique
-            while db.exec(select(User).where(User.username == username)).first():
+            while db.exec(select(exists().where(User.username == username))).one():
                 username = generate_username(first_name, last_name)
             
             # Create new user
@@ -169,11 +172,11 @@ async def google_auth_temp(request: GoogleAuthRequest, db: Session = Depends(get
                     detail="Phone number not verified"
                 )
 
-            existing_user = db.exec(
-                select(User).where(User.phone_number == phone_number)
-            ).first()
+            phone_taken = db.exec(
+                select(exists().where(User.phone_number == phone_number))
+            ).one()
 
-            if existing_user:
+            if phone_taken:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Phone number already registered"
@@ -192,7 +195,7 @@ async def google_auth_temp(request: GoogleAuthRequest, db: Session = Depends(get
             username = generate_username(first_name, last_name)
             
             # Ensure username is unique
-            while db.exec(select(User).where(User.username == username)).first():
+            while db.exec(select(exists().where(User.username == username))).one():
                 username = generate_username(first_name, last_name)
             
             # Create new user
@@ -320,34 +323,33 @@ async def create_phone_verification(
         uid = decoded_token['uid']
         
         # Get the user
-        user = db.exec(
-            select(User).where(User.firebase_uid == uid)
+        user_id = db.exec(
+            select(User.user_id).where(User.firebase_uid == uid)
         ).first()
         
-        if not user:
+        if not user_id:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="User not found"
             )
         
-        # Check if phone number is already registered by another user
-        existing_user = db.exec(
-            select(User).where(
-                (User.phone_number == request.phone_number) &
-                (User.user_id != user.user_id)
+        # Update user's phone number in a single statement, the unique index on
+        # phone_number rejects numbers already registered by another user
+        try:
+            db.exec(
+                update(User)
+                .where(User.user_id == user_id)
+                .values(phone_number=request.phone_number)
+                .execution_options(synchronize_session=False)
             )
-        ).first()
-        
-        if existing_user:
+        except IntegrityError:
+            db.rollback()
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Phone number already registered"
             )
-        
-        # Update user's phone number
-        user.phone_number = request.phone_number
-        db.add(user)
         db.commit()
+        await bump_version(user_me_version_key(user_id))
         
         return {
             "message": "Phone number updated successfully",
@@ -359,6 +361,8 @@ async def create_phone_verification(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid Firebase token"
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -373,11 +377,10 @@ class UsernameCheckResponse(BaseModel):
 @router.get("/check-username", response_model=UsernameCheckResponse)
 def check_username_exists(username: str, session: Session = Depends(get_session)):
     validated_username = validate_username(username)
-    statement = select(User).where(User.username == validated_username)
-    existing_user = session.exec(statement).first()
+    statement = select(exists().where(User.username == validated_username))
     return UsernameCheckResponse(
         username=validated_username,
-        exists=existing_user is not None
+        exists=session.exec(statement).one()
     )
 
 
@@ -1,9 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
 from sqlmodel import Session, select, delete
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Iterable, Optional, List
 from datetime import datetime, timedelta, timezone
 from enum import Enum
+import asyncio
 import json
 
 from ..services.database import get_session
@@ -14,8 +16,10 @@ from ..models.submission import Submission
 from ..models.submission_overlay import SubmissionOverlay, SubmissionOverlayPublic
 from ..models.submission_view import SubmissionView
 from ..services.auth import get_current_user_id
-from ..services.s3 import upload_image, delete_file, extract_key_from_url
+from ..services.s3 import upload_image, delete_file, delete_files, extract_key_from_url
 from ..services.notification import NotificationService
+from ..services.stats import record_submission, refresh_user_stats
+from ..services.cache import delete_cached_indexed, profile_index_key
 
 # Constants
 MAX_SUBMISSIONS_PER_USER = 5
@@ -28,6 +32,10 @@ router = APIRouter(
 # Initialize notification service
 notification_service = NotificationService()
 
+async def invalidate_user_profiles(user_ids: Iterable[int]):
+    # Cached profiles include the user's submission dates, count and streak
+    await delete_cached_indexed(*(profile_index_key(user_id) for user_id in set(user_ids)))
+
 def has_new_submissions(session: Session, challenge_id: int, current_user_id: int) -> bool:
     return session.exec(
         select(1)
@@ -443,14 +451,10 @@ class RemoveParticipantRequest(BaseModel):
     challenge_id: int
     participant_id: int
 
-@router.post("/remove-participant")
-def remove_participant(
-    request: RemoveParticipantRequest,
-    session: Session = Depends(get_session),
-    current_user_id: int = Depends(get_current_user_id)
-):
+def remove_challenge_participant(session: Session, challenge_id: int, participant_id: int, current_user_id: int) -> Optional[str]:
+    """Remove a participant and their submission, returning the photo URL of the deleted submission."""
     # Get challenge and verify ownership
-    challenge = session.get(Challenge, request.challenge_id)
+    challenge = session.get(Challenge, challenge_id)
     if not challenge:
         raise HTTPException(status_code=404, detail="Challenge not found")
     
@@ -464,8 +468,8 @@ def remove_participant(
     invitation = session.exec(
         select(ChallengeInvitation)
         .where(
-            (ChallengeInvitation.challenge_id == request.challenge_id) &
-            (ChallengeInvitation.receiver_id == request.participant_id) &
+            (ChallengeInvitation.challenge_id == challenge_id) &
+            (ChallengeInvitation.receiver_id == participant_id) &
             (ChallengeInvitation.status == InvitationStatus.ACCEPTED)
         )
     ).first()
@@ -482,28 +486,53 @@ def remove_participant(
     submission = session.exec(
         select(Submission)
         .where(
-            (Submission.challenge_id == request.challenge_id) &
-            (Submission.user_id == request.participant_id)
+            (Submission.challenge_id == challenge_id) &
+            (Submission.user_id == participant_id)
         )
     ).first()
 
     if submission:
-        # Delete submission views
+        # Delete submission views and overlays
         session.exec(
             delete(SubmissionView)
             .where(SubmissionView.submission_id == submission.submission_id)
         )
-        
-        # Delete the photo from S3
-        try:
-            delete_file(extract_key_from_url(submission.photo_url))
-        except Exception as e:
-            print(f"Failed to delete S3 photo {submission.photo_url}: {e}")
+        session.exec(
+            delete(SubmissionOverlay)
+            .where(SubmissionOverlay.submission_id == submission.submission_id)
+        )
 
         # Delete the submission
         session.delete(submission)
+        session.flush()
+
+        # Recompute the participant's stored count and streak without it
+        refresh_user_stats(session, [participant_id])
 
     session.commit()
+    return submission.photo_url if submission else None
+
+@router.post("/remove-participant")
+async def remove_participant(
+    request: RemoveParticipantRequest,
+    session: Session = Depends(get_session),
+    current_user_id: int = Depends(get_current_user_id)
+):
+    # The database driver is blocking, run the queries in a worker thread
+    photo_url = await run_in_threadpool(
+        remove_challenge_participant,
+        session,
+        request.challenge_id,
+        request.participant_id,
+        current_user_id
+    )
+
+    if photo_url:
+        await invalidate_user_profiles([request.participant_id])
+
+        # After successful database deletion, delete the photo from S3 off the event loop
+        await asyncio.to_thread(delete_file, extract_key_from_url(photo_url))
+
     return {"message": "Participant removed successfully"}
 
 
@@ -553,11 +582,8 @@ async def submit_challenge_photo(
     if not file.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="File must be an image")
     
-    # Read the file contents before passing to upload_image
-    file_content = await file.read()
-    
     photo_url = await upload_image(
-        file_content,  # Pass the bytes content instead of the file object
+        file.file,
         folder=f"challenge-submissions/{challenge_id}",
         identifier=f"{current_user_id}_{submission_count + 1}",  # Add submission number to identifier
         width=1080,
@@ -590,8 +616,12 @@ async def submit_challenge_photo(
             )
             session.add(overlay)
 
+    # Update the submitter's stored count and streak
+    record_submission(session, current_user_id)
+
     session.commit()
     session.refresh(submission)
+    await invalidate_user_profiles([current_user_id])
 
     # Get submitter and challenge info
     submitter = session.get(User, current_user_id)
@@ -895,6 +925,7 @@ async def delete_challenge(
     ).all()
     
     photo_urls = [submission.photo_url for submission in submissions]
+    submitter_ids = {submission.user_id for submission in submissions}
 
     # Delete in correct order to handle foreign key constraints
     
@@ -934,14 +965,15 @@ async def delete_challenge(
     
     # 5. Delete the challenge
     session.delete(challenge)
+
+    # Recompute stored counts and streaks of everyone who had submitted
+    refresh_user_stats(session, submitter_ids)
     session.commit()
+    await invalidate_user_profiles(submitter_ids)
 
-    # After successful database deletion, delete the S3 photos
-    for photo_url in photo_urls:
-        try:
-            delete_file(extract_key_from_url(photo_url))
-        except Exception as e:
-            print(f"Failed to delete S3 photo {photo_url}: {e}")
-            # Continue with other deletions even if one fails
+    # After successful database deletion, delete the S3 photos in batches, off the event loop
+    photo_keys = [extract_key_from_url(photo_url) for photo_url in photo_urls if photo_url]
+    if photo_keys:
+        await asyncio.to_thread(delete_files, photo_keys)
     
     return {"message": "Challenge and all related data deleted successfully"}
\ No newline at end of file
@@ -1,5 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session, select, and_
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import Session, select, and_, func
+from sqlalchemy import case
 from pydantic import BaseModel
 from datetime import datetime, timedelta
 from typing import List
@@ -11,6 +13,7 @@ from ..models.friendship import Friendship
 from ..services.auth import get_current_user_id
 from ..models.submission import Submission
 from ..services.notification import NotificationService
+from ..services.cache import delete_cached, profile_key
 
 router = APIRouter(
     prefix="/friends",
@@ -29,6 +32,13 @@ class BatchFriendRequestCreate(BaseModel):
 class FriendRequestAction(BaseModel):
     request_id: int
 
+async def invalidate_friendship_profiles(user_id: int, other_user_ids: List[int]):
+    # Cached profiles include the friendship status between both users
+    keys = []
+    for other_user_id in other_user_ids:
+        keys += [profile_key(user_id, other_user_id), profile_key(other_user_id, user_id)]
+    await delete_cached(*keys)
+
 def calculate_mutual_streak(user1_id: int, user2_id: int, session: Session) -> tuple[int, int]:
     # Get dates where both users completed the same challenges
     mutual_submissions = session.exec(
@@ -129,6 +139,7 @@ async def send_friend_request(
             session.add(existing_request)
             session.commit()
             session.refresh(existing_request)
+            await invalidate_friendship_profiles(current_user_id, [request.receiver_id])
             return existing_request
             
         elif existing_request.status != RequestStatus.REJECTED:
@@ -145,6 +156,7 @@ async def send_friend_request(
         session.add(existing_request)
         session.commit()
         session.refresh(existing_request)
+        await invalidate_friendship_profiles(current_user_id, [request.receiver_id])
         return existing_request
 
     # Create new friend request if none exists
@@ -167,6 +179,7 @@ async def send_friend_request(
     
     session.commit()
     session.refresh(new_request)
+    await invalidate_friendship_profiles(current_user_id, [request.receiver_id])
     return new_request
 
 @router.post("/add/batch", response_model=List[FriendRequest])
@@ -242,9 +255,10 @@ async def send_batch_friend_requests(
         )
     
     session.commit()
-    for request in new_requests:
-        session.refresh(request)
+    for new_request in new_requests:
+        session.refresh(new_request)
     
+    await invalidate_friendship_profiles(current_user_id, request.receiver_ids)
     return new_requests
 
 @router.put("/accept", response_model=Friendship)
@@ -286,15 +300,11 @@ async def accept_friend_request(
     session.add(friend_request)
     session.commit()
     session.refresh(friend_request)
+    await invalidate_friendship_profiles(current_user_id, [friend_request.sender_id])
     return new_friendship
 
-@router.put("/reject")
-def reject_friend_request(
-    request: FriendRequestAction,
-    session: Session = Depends(get_session),
-    user_id: int = Depends(get_current_user_id)
-):
-    friend_request = session.get(FriendRequest, request.request_id)
+def reject_pending_request(session: Session, request_id: int, user_id: int) -> FriendRequest:
+    friend_request = session.get(FriendRequest, request_id)
     if not friend_request:
         raise HTTPException(status_code=404, detail="Friend request not found")
     
@@ -310,6 +320,17 @@ def reject_friend_request(
     session.refresh(friend_request)
     return friend_request
 
+@router.put("/reject")
+async def reject_friend_request(
+    request: FriendRequestAction,
+    session: Session = Depends(get_session),
+    user_id: int = Depends(get_current_user_id)
+):
+    # The database driver is blocking, run the queries in a worker thread
+    friend_request = await run_in_threadpool(reject_pending_request, session, request.request_id, user_id)
+    await invalidate_friendship_profiles(user_id, [friend_request.sender_id])
+    return friend_request
+
 class FriendWithStreak(UserPublic):
     mutual_streak: int = 0
     total_mutual_challenges: int = 0
@@ -387,4 +408,24 @@ def get_sent_friend_requests(session: Session = Depends(get_session), user_id: i
             profile_picture=user.profile_picture
         ))
 
-    return friend_requests
\ No newline at end of file
+    return friend_requests
+
+class FriendRequestCounts(BaseModel):
+    received: int
+    sent: int
+
+@router.get("/requests/counts", response_model=FriendRequestCounts)
+def get_friend_request_counts(session: Session = Depends(get_session), user_id: int = Depends(get_current_user_id)):
+    # Count both directions in one aggregate for badges that don't need the request lists
+    received, sent = session.exec(
+        select(
+            func.count(case((FriendRequest.receiver_id == user_id, 1))),
+            func.count(case((FriendRequest.sender_id == user_id, 1)))
+        )
+        .where(
+            ((FriendRequest.receiver_id == user_id) | (FriendRequest.sender_id == user_id)) &
+            (FriendRequest.status == RequestStatus.PENDING)
+        )
+    ).one()
+
+    return FriendRequestCounts(received=received, sent=sent)
\ No newline at end of file
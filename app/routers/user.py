@@ -1,22 +1,36 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
-from sqlmodel import Session, select
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, Response, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import Session, select, update, delete
+from sqlalchemy import JSON, case, func, tuple_
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.dialects.mysql import match
 from typing import Optional, List
 from pydantic import BaseModel
-from datetime import datetime, timedelta
+from datetime import datetime
 from enum import Enum
+import asyncio
+import hashlib
+import json
 
-from ..services.database import get_session
+from ..services.database import engine, get_session
 from ..models.user import User, UserPublic
 from ..models.friendship import Friendship
 from ..models.friend_request import FriendRequest, RequestStatus
 from ..services.auth import get_current_user_id, validate_username
-from ..services.s3 import upload_image, extract_key_from_url, delete_file
+from ..services.s3 import upload_image, extract_key_from_url, delete_file, delete_files
 from ..models.submission import Submission
+from ..models.challenge import Challenge
+from ..models.challenge_invitation import ChallengeInvitation
 from ..models.submission_overlay import SubmissionOverlay
 from ..models.submission_view import SubmissionView
 from ..models.contact import Contact
 from ..models.device import Device
 from ..services.notification import NotificationService
+from ..services.cache import (
+    get_cached, set_cached, get_cached_versioned, set_cached_versioned, bump_version, delete_cached_indexed,
+    user_me_key, user_me_version_key, profile_key, profile_index_key, search_key
+)
+from ..services.stats import get_current_streak, refresh_user_stats
 
 router = APIRouter(
     prefix="/user",
@@ -26,8 +40,19 @@ router = APIRouter(
 # Initialize notification service
 notification_service = NotificationService()
 
-# Constants for streak calculation
-MAX_STREAK_GAP_DAYS = 3  # Maximum allowed gap between active days to maintain streak
+# How long responses stay cached (in seconds)
+USER_ME_CACHE_TTL = 600
+PROFILE_CACHE_TTL = 30
+SEARCH_CACHE_TTL = 20
+
+# /user/me loads currently running, keyed by user ID and cache version
+inflight_me_loads: dict[tuple[int, int], asyncio.Task] = {}
+
+# Shortest search query the ngram full-text index can match (innodb ngram_token_size)
+NGRAM_TOKEN_SIZE = 2
+
+# MySQL error raised by MATCH ... AGAINST when the full-text index does not exist
+ER_FT_MATCHING_KEY_NOT_FOUND = 1191
 
 class FriendshipStatus(str, Enum):
     FRIENDS = "friends"
@@ -35,84 +60,125 @@ class FriendshipStatus(str, Enum):
     REQUEST_RECEIVED = "request_received"
     NONE = "none"
 
-def calculate_streak(completion_dates: List[datetime]) -> int:
-    if not completion_dates:
-        return 0
-        
-    # Convert to dates only (ignore time) and get unique dates
-    unique_dates = sorted(set(d.date() for d in completion_dates), reverse=True)
-    
-    # Check if there's activity today or in the last 3 days
-    today = datetime.now().date()
-    if (today - unique_dates[0]) > timedelta(days=MAX_STREAK_GAP_DAYS):
-        return 0  # Streak is broken if no activity in last 3 days
-        
-    streak = 1
-    allowed_gap = timedelta(days=MAX_STREAK_GAP_DAYS)  # Maximum allowed gap between active days
-    
-    # Start from the second most recent date
-    for i in range(1, len(unique_dates)):
-        gap = unique_dates[i-1] - unique_dates[i]
-        if gap <= allowed_gap:
-            streak += 1
-        else:
-            break
-            
-    return streak
-
-
 class UserMe(UserPublic):
     email: Optional[str]
     phone_number: Optional[str]
 
+def make_etag(payload: dict) -> str:
+    """Weak ETag from a hash of the response body, so different bodies never share a tag."""
+    serialized = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()
+    return f'W/"{hashlib.blake2b(serialized, digest_size=16).hexdigest()}"'
+
+def fetch_current_user(current_user_id: int) -> dict:
+    # Uses its own session, a shared load can outlive the request that started it
+    with Session(engine) as session:
+        user = session.get(User, current_user_id)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        return UserMe.model_validate(user).model_dump(mode="json")
+
+async def load_current_user(current_user_id: int, version: Optional[int]) -> dict:
+    # The database driver is blocking, query from a worker thread so the event loop
+    # stays free and concurrent requests for the same user can join this load
+    user_me = await run_in_threadpool(fetch_current_user, current_user_id)
+    if version is not None:
+        await set_cached_versioned(user_me_key(current_user_id), user_me, USER_ME_CACHE_TTL, version)
+    return user_me
+
 @router.get("/me", response_model=UserMe)
-def read_current_user(
-    session: Session = Depends(get_session),
+async def read_current_user(
+    request: Request,
+    response: Response,
     current_user_id: int = Depends(get_current_user_id)
 ):
-    user = session.exec(
-        select(User).where(User.user_id == current_user_id)
-    ).first()
+    user_me, version = await get_cached_versioned(
+        user_me_key(current_user_id),
+        user_me_version_key(current_user_id)
+    )
 
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    if user_me is None and version is None:
+        # The cache is unreachable, so writes can't be told apart, load without sharing
+        user_me = await load_current_user(current_user_id, None)
+    elif user_me is None:
+        # Concurrent requests that saw the same version share a single load.
+        # Requests arriving after a write see the bumped version and start a new one.
+        load_key = (current_user_id, version)
+        task = inflight_me_loads.get(load_key)
+        if task is None:
+            task = asyncio.create_task(load_current_user(current_user_id, version))
+            inflight_me_loads[load_key] = task
+            task.add_done_callback(lambda _: inflight_me_loads.pop(load_key, None))
 
-    return user
+        # Shield the load so a cancelled request doesn't cancel it for the others
+        user_me = await asyncio.shield(task)
+
+    etag = make_etag(user_me)
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    response.headers["ETag"] = etag
+    return user_me
 
 
 class SearchUser(UserPublic):
     request_id: Optional[int]
     friendship_status: FriendshipStatus
 
+def query_users(session: Session, condition, ordering, current_user_id: int, skip: int, limit: int) -> List[dict]:
+    # Select only the columns returned by UserPublic instead of hydrating full User rows
+    statement = (
+        select(User.user_id, User.username, User.display_name, User.profile_picture)
+        .where(condition)
+        .where(User.user_id != current_user_id)  # Skip the current user
+        .order_by(ordering, User.user_id)  # Break ties so skip/limit pages don't overlap
+        .offset(skip)
+        .limit(limit)
+    )
+    return [row._asdict() for row in session.exec(statement).all()]
+
+def find_users(session: Session, phrase: str, current_user_id: int, skip: int, limit: int) -> List[dict]:
+    if len(phrase) >= NGRAM_TOKEN_SIZE:
+        # Best matches first, MySQL computes the relevance once for both clauses
+        condition = match(User.username, User.display_name, against=f'"{phrase}"').in_boolean_mode()
+        try:
+            return query_users(session, condition, condition.desc(), current_user_id, skip, limit)
+        except OperationalError as e:
+            # Databases created before ix_user_search was added don't have the index yet
+            if e.orig.args[0] != ER_FT_MATCHING_KEY_NOT_FOUND:
+                raise
+            session.rollback()
+            print(f"Failed to search users by full text, falling back to prefix search: {str(e)}")
+
+    # Short queries, and databases without the full-text index, use an indexed prefix match
+    condition = (
+        User.display_name.startswith(phrase, autoescape=True) |
+        User.username.startswith(phrase, autoescape=True)
+    )
+    return query_users(session, condition, User.username, current_user_id, skip, limit)
+
 @router.get("/search", response_model=List[UserPublic])
-def search_users(
+async def search_users(
     q: str = "",
     skip: int = 0,
     limit: int = 20,
     session: Session = Depends(get_session),
     current_user_id: int = Depends(get_current_user_id)
 ):
+    # Quotes are stripped so the query is always matched as a single phrase
+    phrase = q.replace('"', '').strip()
+
     # If query is empty, return empty results
-    if not q:
+    if not phrase:
         return []
 
-    statement = (
-        select(User)
-        .where(
-            (User.display_name.ilike(f"%{q}%")) | (User.username.ilike(f"%{q}%"))
-        )
-        .offset(skip)
-        .limit(limit)
-    )
-    
-    results = session.exec(statement).all()
-    users = []
-    
-    for user in results:
-        if user.user_id == current_user_id:
-            continue  # Skip the current user
-        users.append(user)
+    cache_key = search_key(current_user_id, phrase, skip, limit)
+    cached_users = await get_cached(cache_key)
+    if cached_users is not None:
+        return cached_users
+
+    users = await run_in_threadpool(find_users, session, phrase, current_user_id, skip, limit)
     
+    await set_cached(cache_key, users, SEARCH_CACHE_TTL)
     return users
 
 
@@ -123,62 +189,91 @@ class UserProfile(UserPublic):
     total_challenges_completed: int = 0
     current_streak: int = 0
 
-@router.get("/{user_id}", response_model=UserProfile)
-def read_user(
-    user_id: int, 
-    session: Session = Depends(get_session), 
-    current_user_id: int = Depends(get_current_user_id)
-):
+def load_user_profile(session: Session, user_id: int, current_user_id: int) -> dict:
+    # Both orderings of the pair, matched as row constructors so MySQL can
+    # range-scan the composite pair indexes instead of evaluating OR predicates
+    user_pairs = [(user_id, current_user_id), (current_user_id, user_id)]
+
+    # Friendship state is derived by the database, so only the user row is hydrated
+    friendship_status = case(
+        (Friendship.friendship_id.is_not(None), FriendshipStatus.FRIENDS.value),
+        (
+            (FriendRequest.status == RequestStatus.PENDING) & (FriendRequest.sender_id == current_user_id),
+            FriendshipStatus.REQUEST_SENT.value
+        ),
+        (FriendRequest.status == RequestStatus.PENDING, FriendshipStatus.REQUEST_RECEIVED.value),
+        else_=FriendshipStatus.NONE.value
+    ).label("friendship_status")
+    request_id = case(
+        (Friendship.friendship_id.is_(None), FriendRequest.request_id)
+    ).label("request_id")
+
+    # Challenge completion dates are aggregated per user in a correlated subquery,
+    # which the pair joins can't repeat the way joined submission rows were
+    completion_dates = (
+        select(func.json_arrayagg(Submission.submitted_at, type_=JSON))
+        .where(Submission.user_id == User.user_id)
+        .scalar_subquery()
+        .label("completion_dates")
+    )
+
+    # Fetch the user, friendship state and submission dates in a single query
     statement = (
-        select(User, Friendship, FriendRequest)
+        select(User, friendship_status, request_id, completion_dates)
+        .select_from(User)
         .outerjoin(
             Friendship,
-            ((Friendship.user1_id == User.user_id) & (Friendship.user2_id == current_user_id)) |
-            ((Friendship.user2_id == User.user_id) & (Friendship.user1_id == current_user_id))
+            tuple_(Friendship.user1_id, Friendship.user2_id).in_(user_pairs)
         )
         .outerjoin(
             FriendRequest,
-            (FriendRequest.receiver_id == User.user_id) & (FriendRequest.sender_id == current_user_id) |
-            (FriendRequest.receiver_id == current_user_id) & (FriendRequest.sender_id == user_id)
+            tuple_(FriendRequest.sender_id, FriendRequest.receiver_id).in_(user_pairs)
         )
         .where(User.user_id == user_id)
+        .limit(1)
     )
     
     result = session.exec(statement).first()
     if not result:
         raise HTTPException(status_code=404, detail="User not found")
         
-    user, friendship, request = result
+    user, status, status_request_id, submitted_at_values = result
     user_dict = user.model_dump()
     
-    # Get challenge completion dates and count
-    completion_dates = session.exec(
-        select(Submission.submitted_at)
-        .where(Submission.user_id == user_id)
-        .order_by(Submission.submitted_at.desc())
-    ).all()
+    # MySQL's JSON_ARRAYAGG can't order its values, sort them newest first here.
+    # It returns NULL for users without submissions.
+    completion_dates = sorted(
+        (datetime.fromisoformat(submitted_at) for submitted_at in submitted_at_values or []),
+        reverse=True
+    )
     
     user_dict["challenge_completion_dates"] = completion_dates
-    user_dict["total_challenges_completed"] = len(completion_dates)
-    user_dict["current_streak"] = calculate_streak(completion_dates)
+    user_dict["current_streak"] = get_current_streak(user)
+    user_dict["friendship_status"] = status
+    user_dict["request_id"] = status_request_id
     
-    if friendship:
-        user_dict["request_id"] = None
-        user_dict["friendship_status"] = FriendshipStatus.FRIENDS
-    elif request:
-        user_dict["request_id"] = request.request_id
-        if request.status == RequestStatus.PENDING:
-            user_dict["friendship_status"] = (
-                FriendshipStatus.REQUEST_SENT if request.sender_id == current_user_id 
-                else FriendshipStatus.REQUEST_RECEIVED
-            )
-        elif request.status == RequestStatus.REJECTED:
-            user_dict["friendship_status"] = FriendshipStatus.NONE
-    else:
-        user_dict["request_id"] = None
-        user_dict["friendship_status"] = FriendshipStatus.NONE
-    
-    return user_dict
+    return UserProfile.model_validate(user_dict).model_dump(mode="json")
+
+@router.get("/{user_id}", response_model=UserProfile)
+async def read_user(
+    user_id: int, 
+    request: Request,
+    response: Response,
+    session: Session = Depends(get_session), 
+    current_user_id: int = Depends(get_current_user_id)
+):
+    cache_key = profile_key(user_id, current_user_id)
+    profile = await get_cached(cache_key)
+    if not profile:
+        profile = await run_in_threadpool(load_user_profile, session, user_id, current_user_id)
+        await set_cached(cache_key, profile, PROFILE_CACHE_TTL, index_key=profile_index_key(user_id))
+
+    etag = make_etag(profile)
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    response.headers["ETag"] = etag
+    return profile
 
 
 class UpdateUsernameRequest(BaseModel):
@@ -195,23 +290,24 @@ async def update_username(
 ):
     validated_username = validate_username(request.username)
 
-    # Check if username is taken
-    existing_user = session.exec(
-        select(User).where(User.username == validated_username)
-    ).first()
-    if existing_user:
+    # Update in a single statement, the unique index on username rejects taken usernames
+    try:
+        result = session.exec(
+            update(User)
+            .where(User.user_id == current_user_id)
+            .values(username=validated_username)
+            .execution_options(synchronize_session=False)
+        )
+    except IntegrityError:
+        session.rollback()
         raise HTTPException(status_code=400, detail="Username already taken")
-    
-    # Update username
-    user = session.exec(select(User).where(User.user_id == current_user_id)).first()
-    if not user:
+
+    if result.rowcount == 0:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    user.username = validated_username
-    session.add(user)
+
     session.commit()
-    session.refresh(user)
-    return user
+    await bump_version(user_me_version_key(current_user_id))
+    return session.get(User, current_user_id)
 
 
 @router.put("/display-name", response_model=UserPublic)
@@ -220,19 +316,23 @@ async def update_display_name(
     session: Session = Depends(get_session),
     current_user_id: int = Depends(get_current_user_id)
 ):
-    user = session.get(User, current_user_id)
-    if not user:
+    result = session.exec(
+        update(User)
+        .where(User.user_id == current_user_id)
+        .values(display_name=request.display_name)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    user.display_name = request.display_name
-    session.add(user)
+
     session.commit()
-    session.refresh(user)
-    return user
+    await bump_version(user_me_version_key(current_user_id))
+    return session.get(User, current_user_id)
 
 
 @router.put("/profile-picture", response_model=UserPublic)
 async def update_profile_picture(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     session: Session = Depends(get_session),
     current_user_id: int = Depends(get_current_user_id)
@@ -246,17 +346,10 @@ async def update_profile_picture(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Delete old profile picture if it exists
-    if user.profile_picture:
-        old_key = extract_key_from_url(user.profile_picture)
-        if old_key:
-            delete_file(old_key)
+    old_key = extract_key_from_url(user.profile_picture) if user.profile_picture else None
 
-    # Read the file contents before passing to upload_image
-    file_content = await file.read()
-    
     s3_url = await upload_image(
-        file_content=file_content,
+        file=file.file,
         folder="profile-pictures",
         identifier=str(current_user_id),
         width=400,
@@ -265,9 +358,13 @@ async def update_profile_picture(
 
     # Update user profile picture URL
     user.profile_picture = s3_url
-    session.add(user)
     session.commit()
-    session.refresh(user)
+    await bump_version(user_me_version_key(current_user_id))
+
+    # Delete old profile picture after the response has been sent
+    if old_key:
+        background_tasks.add_task(delete_file, old_key)
+
     return user
 
 @router.delete("/me", status_code=204)
@@ -280,81 +377,89 @@ async def delete_user(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Delete profile picture from S3 if exists
-    if user.profile_picture:
-        old_key = extract_key_from_url(user.profile_picture)
-        if old_key:
-            delete_file(old_key)
+    # Challenges created by the user are deleted along with everything in them,
+    # including other participants' submissions
+    user_challenge_ids = (
+        select(Challenge.challenge_id)
+        .where(Challenge.creator_id == current_user_id)
+    )
+    deleted_submissions = (
+        (Submission.user_id == current_user_id) |
+        Submission.challenge_id.in_(user_challenge_ids)
+    )
 
-    # Get all submission photo URLs before deleting the records
+    # Get all submission photo URLs and submitters before deleting the records
     submissions = session.exec(
-        select(Submission)
-        .where(Submission.user_id == current_user_id)
+        select(Submission.photo_url, Submission.user_id)
+        .where(deleted_submissions)
     ).all()
-    
     photo_urls = [submission.photo_url for submission in submissions]
+    other_submitter_ids = {submission.user_id for submission in submissions} - {current_user_id}
 
-    # Delete in correct order to handle foreign key constraints
-    
-    # 1. Delete submission views first
-    session.exec(
-        select(SubmissionView).where(
-            SubmissionView.submission_id.in_(
-                select(Submission.submission_id)
-                .where(Submission.user_id == current_user_id)
-            )
-        )
-    ).delete()
-
-    # 2. Delete submission overlays
-    session.exec(
-        select(SubmissionOverlay).where(
-            SubmissionOverlay.submission_id.in_(
-                select(Submission.submission_id)
-                .where(Submission.user_id == current_user_id)
-            )
-        )
-    ).delete()
-
-    # 3. Delete submissions
-    session.exec(
-        select(Submission).where(Submission.user_id == current_user_id)
-    ).delete()
-
-    # 4. Delete contacts
-    session.exec(
-        select(Contact).where(Contact.user_id == current_user_id)
-    ).delete()
-
-    # 5. Delete devices
-    session.exec(
-        select(Device).where(Device.user_id == current_user_id)
-    ).delete()
-
-    # 6. Delete all friendships
-    session.exec(
-        select(Friendship).where(
+    # Delete in correct order to handle foreign key constraints.
+    # Each step is a single DELETE statement, no rows are loaded into the session.
+    deleted_submission_ids = (
+        select(Submission.submission_id)
+        .where(deleted_submissions)
+    )
+    statements = [
+        # 1. Delete views of the deleted submissions and the user's own views
+        delete(SubmissionView).where(
+            SubmissionView.submission_id.in_(deleted_submission_ids) |
+            (SubmissionView.viewer_id == current_user_id)
+        ),
+        # 2. Delete submission overlays
+        delete(SubmissionOverlay).where(SubmissionOverlay.submission_id.in_(deleted_submission_ids)),
+        # 3. Delete submissions
+        delete(Submission).where(deleted_submissions),
+        # 4. Delete invitations to the user's challenges and all received by the user
+        delete(ChallengeInvitation).where(
+            ChallengeInvitation.challenge_id.in_(user_challenge_ids) |
+            (ChallengeInvitation.receiver_id == current_user_id)
+        ),
+        # 5. Hand invitations the user sent to others over to the challenge creator,
+        # so the invited participants stay in the challenge
+        update(ChallengeInvitation)
+        .where(ChallengeInvitation.sender_id == current_user_id)
+        .values(
+            sender_id=select(Challenge.creator_id)
+            .where(Challenge.challenge_id == ChallengeInvitation.challenge_id)
+            .scalar_subquery()
+        ),
+        # 6. Delete the user's challenges
+        delete(Challenge).where(Challenge.creator_id == current_user_id),
+        # 7. Delete contacts
+        delete(Contact).where(Contact.user_id == current_user_id),
+        # 8. Delete devices
+        delete(Device).where(Device.user_id == current_user_id),
+        # 9. Delete all friendships
+        delete(Friendship).where(
             (Friendship.user1_id == current_user_id) | 
             (Friendship.user2_id == current_user_id)
-        )
-    ).delete()
-
-    # 7. Delete all friend requests (both sent and received)
-    session.exec(
-        select(FriendRequest).where(
+        ),
+        # 10. Delete all friend requests (both sent and received)
+        delete(FriendRequest).where(
             (FriendRequest.sender_id == current_user_id) | 
             (FriendRequest.receiver_id == current_user_id)
-        )
-    ).delete()
-
-    # 8. Delete the user
-    session.delete(user)
+        ),
+        # 11. Delete the user
+        delete(User).where(User.user_id == current_user_id),
+    ]
+    for statement in statements:
+        session.exec(statement.execution_options(synchronize_session=False))
+
+    # Recompute stored counts and streaks of participants who lost submissions
+    refresh_user_stats(session, other_submitter_ids)
     session.commit()
-
-    # After successful database deletion, delete the S3 photos
-    for photo_url in photo_urls:
-        try:
-            delete_file(extract_key_from_url(photo_url))
-        except Exception as e:
-            print(f"Failed to delete S3 photo {photo_url}: {e}")
-            # Continue with other deletions even if one fails
\ No newline at end of file
+    await bump_version(user_me_version_key(current_user_id))
+    await delete_cached_indexed(*(profile_index_key(user_id) for user_id in {current_user_id, *other_submitter_ids}))
+
+    # After successful database deletion, delete the profile picture and
+    # submission photos from S3 in batches, off the event loop
+    photo_keys = [
+        extract_key_from_url(photo_url)
+        for photo_url in [*photo_urls, user.profile_picture]
+        if photo_url
+    ]
+    if photo_keys:
+        await asyncio.to_thread(delete_files, photo_keys)
@@ -0,0 +1,100 @@
+import redis.asyncio as redis
+from typing import Optional, Tuple
+import json
+
+from ..config import REDIS_URL, REDIS_TIMEOUT
+
+# Short timeouts so an unreachable Redis fails fast and is treated as a cache miss
+redis_client = redis.from_url(
+    REDIS_URL,
+    decode_responses=True,
+    socket_connect_timeout=REDIS_TIMEOUT,
+    socket_timeout=REDIS_TIMEOUT
+)
+
+# Key versions are bumped whenever the cached payload changes shape
+def user_me_key(user_id: int) -> str:
+    return f"user:me:v4:{user_id}"
+
+def user_me_version_key(user_id: int) -> str:
+    # Bumped on every write to the user row, see get_cached_versioned
+    return f"user:me:version:{user_id}"
+
+def profile_key(user_id: int, viewer_id: int) -> str:
+    return f"profile:v3:{user_id}:viewer:{viewer_id}"
+
+def profile_index_key(user_id: int) -> str:
+    # Set of the cached profile keys of a user, one per viewer
+    return f"profile:v3:{user_id}:viewers"
+
+def search_key(viewer_id: int, q: str, skip: int, limit: int) -> str:
+    return f"search:{viewer_id}:{skip}:{limit}:{q}"
+
+async def get_cached(key: str) -> Optional[dict]:
+    try:
+        value = await redis_client.get(key)
+    except Exception as e:
+        # Treat an unreachable cache as a miss so requests fall back to the database
+        print(f"Failed to read cache key {key}: {str(e)}")
+        return None
+    return json.loads(value) if value else None
+
+async def set_cached(key: str, value: dict, expire: int, index_key: Optional[str] = None) -> None:
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.setex(key, expire, json.dumps(value))
+            if index_key:
+                # Record the key so it can be deleted with the rest of its group,
+                # the index lives as long as the keys added to it last
+                pipe.sadd(index_key, key)
+                pipe.expire(index_key, expire)
+            await pipe.execute()
+    except Exception as e:
+        print(f"Failed to write cache key {key}: {str(e)}")
+
+async def get_cached_versioned(key: str, version_key: str) -> Tuple[Optional[dict], Optional[int]]:
+    """Cached value if it was stored under the current version, and the current version.
+
+    The version is None when the cache is unreachable.
+    """
+    try:
+        version, value = await redis_client.mget(version_key, key)
+    except Exception as e:
+        print(f"Failed to read cache key {key}: {str(e)}")
+        return None, None
+    version = int(version or 0)
+    if value:
+        cached = json.loads(value)
+        if cached["version"] == version:
+            return cached["value"], version
+    return None, version
+
+async def set_cached_versioned(key: str, value: dict, expire: int, version: int) -> None:
+    # Values stored under an older version are never returned, so a load that read
+    # the database before a write can't bring back the old data
+    await set_cached(key, {"version": version, "value": value}, expire)
+
+async def bump_version(version_key: str) -> None:
+    try:
+        await redis_client.incr(version_key)
+    except Exception as e:
+        print(f"Failed to bump cache version {version_key}: {str(e)}")
+
+async def delete_cached(*keys: str) -> None:
+    try:
+        await redis_client.delete(*keys)
+    except Exception as e:
+        print(f"Failed to delete cache keys {keys}: {str(e)}")
+
+async def delete_cached_indexed(*index_keys: str) -> None:
+    if not index_keys:
+        return
+    try:
+        # Read the members of every index in one round trip, then delete them with the indexes
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for index_key in index_keys:
+                pipe.smembers(index_key)
+            members = await pipe.execute()
+        await redis_client.delete(*index_keys, *(key for keys in members for key in keys))
+    except Exception as e:
+        print(f"Failed to delete cache keys indexed by {index_keys}: {str(e)}")
@@ -1,12 +1,25 @@
 from sqlmodel import Session, SQLModel, create_engine
+from sqlalchemy import inspect
 from ..config import DATABASE_URL
 
-# SQLModel database engine
-engine = create_engine(DATABASE_URL)
+# SQLModel database engine. Connections are checked before use and recycled
+# before MySQL's idle timeout can drop them.
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=8,
+    max_overflow=8,
+    pool_pre_ping=True,
+    pool_recycle=1800
+)
 
 def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+    # List the existing tables in one query and skip create_all, which checks
+    # every table separately, when the schema is already there
+    existing_tables = set(inspect(engine).get_table_names())
+    if not set(SQLModel.metadata.tables) <= existing_tables:
+        SQLModel.metadata.create_all(engine)
 
 def get_session():
-    with Session(engine) as session:
+    # Objects keep their loaded attributes after commit instead of being reloaded on next access
+    with Session(engine, expire_on_commit=False) as session:
         yield session
\ No newline at end of file
@@ -3,10 +3,14 @@ from firebase_admin import credentials, messaging
 from typing import Optional, List
 from enum import Enum
 from sqlmodel import Session, select
+import asyncio
 
 from app.config import FIREBASE_CREDENTIALS_JSON
 from app.models.device import Device
 
+# Maximum number of tokens FCM accepts in a single multicast message
+MULTICAST_BATCH_SIZE = 500
+
 class NotificationType(str, Enum):
     CHALLENGE_INVITE = "challenge_invite"
     CHALLENGE_SUBMISSION = "challenge_submission"
@@ -48,6 +52,35 @@ class NotificationService:
             print(f"Error sending notification: {e}")
             return False
 
+    async def send_multicast(
+        self,
+        fcm_tokens: List[str],
+        title: str,
+        body: str,
+        data: Optional[dict] = None
+    ) -> List[bool]:
+        results = []
+        for i in range(0, len(fcm_tokens), MULTICAST_BATCH_SIZE):
+            tokens = fcm_tokens[i:i + MULTICAST_BATCH_SIZE]
+            message = messaging.MulticastMessage(
+                notification=messaging.Notification(
+                    title=title,
+                    body=body,
+                ),
+                data=data or {},
+                tokens=tokens,
+            )
+
+            try:
+                # The SDK call is blocking, run it off the event loop
+                response = await asyncio.to_thread(messaging.send_each_for_multicast, message)
+                results.extend(r.success for r in response.responses)
+            except Exception as e:
+                print(f"Error sending multicast notification: {e}")
+                results.extend(False for _ in tokens)
+
+        return results
+
     async def send_notification_to_user(
         self,
         db: Session,
@@ -56,25 +89,23 @@ class NotificationService:
         body: str,
         data: Optional[dict] = None
     ) -> List[bool]:
-        # Get all devices for the user
-        devices = db.exec(
-            select(Device)
+        # Get the FCM tokens of all the user's devices
+        fcm_tokens = db.exec(
+            select(Device.fcm_token)
             .where(Device.user_id == user_id)
             .where(Device.fcm_token.is_not(None))  # Only get devices with FCM tokens
         ).all()
         
-        # Send notification to all devices
-        results = []
-        for device in devices:
-            success = await self.send_notification(
-                fcm_token=device.fcm_token,
-                title=title,
-                body=body,
-                data=data
-            )
-            results.append(success)
-        
-        return results
+        if not fcm_tokens:
+            return []
+
+        # Send notification to all devices in one multicast
+        return await self.send_multicast(
+            fcm_tokens=list(fcm_tokens),
+            title=title,
+            body=body,
+            data=data
+        )
 
     async def send_challenge_invite(
         self,
@@ -118,15 +149,13 @@ class NotificationService:
 
     async def send_challenge_ending(
         self,
-        db: Session,
-        user_id: int,
+        fcm_tokens: List[str],
         challenge_title: str,
         challenge_id: int,
         hours_left: int
     ):
-        return await self.send_notification_to_user(
-            db=db,
-            user_id=user_id,
+        return await self.send_multicast(
+            fcm_tokens=fcm_tokens,
             title="Challenge Ending Soon!",
             body=f"'{challenge_title}' ends in {hours_left} hours",
             data={
@@ -1,74 +1,139 @@
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from fastapi import HTTPException
 from urllib.parse import urlparse
 from PIL import Image
 from io import BytesIO
+from typing import BinaryIO, List
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import asyncio
 import uuid
 
-from ..config import AWS_ACCESS_KEY, AWS_SECRET_KEY, S3_REGION, S3_BUCKET_NAME, S3_URL
+from ..config import AWS_ACCESS_KEY, AWS_SECRET_KEY, S3_REGION, S3_BUCKET_NAME, S3_URL, IMAGE_PROCESSING_CONCURRENCY, IMAGE_QUEUE_TIMEOUT
 
+# Shared client, a larger connection pool keeps TLS connections to S3 warm across
+# concurrent uploads and deletes instead of reconnecting once the default 10 are busy
 s3_client = boto3.client("s3",
     aws_access_key_id=AWS_ACCESS_KEY,
     aws_secret_access_key=AWS_SECRET_KEY,
-    region_name=S3_REGION
+    region_name=S3_REGION,
+    config=Config(
+        max_pool_connections=64,
+        retries={'max_attempts': 3, 'mode': 'adaptive'},
+        tcp_keepalive=True,
+        connect_timeout=3,
+        read_timeout=30
+    )
 )
 
+# Bounded multipart settings so large uploads are sent in chunks instead of one in-memory body
+transfer_config = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_io_queue=2,
+    use_threads=True
+)
+
+# Worker threads for CPU-bound image processing
+image_executor = ThreadPoolExecutor(max_workers=IMAGE_PROCESSING_CONCURRENCY)
+
+# Admission control, uploads beyond the limit wait in FIFO order instead of all decoding at once
+image_slots = asyncio.Semaphore(IMAGE_PROCESSING_CONCURRENCY)
+
+# Prefix of every object URL built by get_s3_url
+S3_URL_PREFIX = f"{S3_URL}/"
+
+# Objects under this prefix can be referenced by many rows (e.g. seed data),
+# they are never owned by a single user and never deleted by the app
+SHARED_KEY_PREFIX = "shared/"
+
 def get_s3_url(key: str) -> str:
-    return f"{S3_URL}/{key}"
+    return f"{S3_URL_PREFIX}{key}"
 
+@lru_cache(maxsize=4096)
 def extract_key_from_url(url: str) -> str:
+    # URLs we generated only need the prefix stripped, anything else is parsed
+    if url.startswith(S3_URL_PREFIX):
+        return url[len(S3_URL_PREFIX):]
     parsed_url = urlparse(url)
     return parsed_url.path.lstrip("/")
 
-async def upload_image(file_content: bytes, 
+def process_image(file: BinaryIO, width: int, height: int, quality: int) -> BytesIO:
+    # Process image, reading it straight from the uploaded file
+    image = Image.open(file)
+
+    # Let libjpeg decode at the smallest scale that still covers the target size
+    image.draft('RGB', (width, height))
+    
+    # Convert to RGB if image is in RGBA mode
+    if image.mode == 'RGBA':
+        image = image.convert('RGB')
+    
+    target_ratio = width / height
+    current_ratio = image.width / image.height
+    
+    if current_ratio != target_ratio:
+        # Crop the image to match target ratio
+        if current_ratio > target_ratio:
+            # Image is too wide - crop width
+            new_width = int(image.height * target_ratio)
+            left = (image.width - new_width) // 2
+            image = image.crop((left, 0, left + new_width, image.height))
+        else:
+            # Image is too tall - crop height
+            new_height = int(image.width / target_ratio)
+            top = (image.height - new_height) // 2
+            image = image.crop((0, top, image.width, top + new_height))
+    
+    # Resize to target dimensions, large downscales are first reduced by an integer
+    # factor with a cheap box filter and only the final step uses the slower filter.
+    # Images already close to the target size are resized with the cheaper bilinear filter.
+    if image.width > width * 2:
+        resample = Image.Resampling.LANCZOS
+    elif image.width > width:
+        resample = Image.Resampling.BILINEAR
+    else:
+        resample = Image.Resampling.BICUBIC
+    image = image.resize((width, height), resample, reducing_gap=3.0)
+    
+    # Save processed image to memory
+    output = BytesIO()
+    image.save(output, format='JPEG', quality=quality)
+    output.seek(0)
+    return output
+
+async def upload_image(file: BinaryIO, 
                         folder: str,
                         identifier: str,
                         width: int = 1080,
                         height: int = 1920,
                         quality: int = 85) -> str:
     try:
-        # Process image
-        image = Image.open(BytesIO(file_content))
-        
-        # Convert to RGB if image is in RGBA mode
-        if image.mode == 'RGBA':
-            image = image.convert('RGB')
-        
-        target_ratio = width / height
-        current_ratio = image.width / image.height
-        
-        if current_ratio != target_ratio:
-            # Crop the image to match target ratio
-            if current_ratio > target_ratio:
-                # Image is too wide - crop width
-                new_width = int(image.height * target_ratio)
-                left = (image.width - new_width) // 2
-                image = image.crop((left, 0, left + new_width, image.height))
-            else:
-                # Image is too tall - crop height
-                new_height = int(image.width / target_ratio)
-                top = (image.height - new_height) // 2
-                image = image.crop((0, top, image.width, top + new_height))
-        
-        # Resize to target dimensions
-        image = image.resize((width, height), 
-            Image.Resampling.LANCZOS if image.width > width 
-            else Image.Resampling.BICUBIC
-        )
-        
-        # Save processed image to memory
-        output = BytesIO()
-        image.save(output, format='JPEG', quality=quality)
-        output.seek(0)
+        await asyncio.wait_for(image_slots.acquire(), timeout=IMAGE_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Image processing is busy, please try again")
+
+    try:
+        # Decode, resize and encode off the event loop, Pillow releases the GIL for this work
+        loop = asyncio.get_running_loop()
+        try:
+            output = await loop.run_in_executor(image_executor, process_image, file, width, height, quality)
+        finally:
+            image_slots.release()
         
         # Generate filename and upload
-        filename = f"{folder}/{identifier}{'-' if identifier else ''}{uuid.uuid4()}.jpg"
+        filename = f"{folder}/{identifier}{'-' if identifier else ''}{uuid.uuid4().hex}.jpg"
         
-        s3_client.upload_fileobj(
+        # boto3 is blocking, upload in a worker thread so the event loop keeps serving requests
+        await asyncio.to_thread(
+            s3_client.upload_fileobj,
             output,
             S3_BUCKET_NAME,
             filename,
-            ExtraArgs={'ContentType': 'image/jpeg'}
+            ExtraArgs={'ContentType': 'image/jpeg'},
+            Config=transfer_config
         )
         
         return get_s3_url(filename)
@@ -77,9 +142,35 @@ async def upload_image(file_content: bytes,
         raise HTTPException(status_code=500, detail=f"Failed to process or upload image: {str(e)}")
 
 def delete_file(key: str) -> bool:
+    if key.startswith(SHARED_KEY_PREFIX):
+        return True
     try:
         s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=key)
         return True
     except Exception as e:
         print(f"Failed to delete file {key}: {str(e)}")
-        return False
\ No newline at end of file
+        return False
+
+# Maximum number of keys S3 accepts in a single DeleteObjects request
+DELETE_BATCH_SIZE = 1000
+
+def delete_files(keys: List[str]) -> bool:
+    keys = [key for key in keys if not key.startswith(SHARED_KEY_PREFIX)]
+    success = True
+    for i in range(0, len(keys), DELETE_BATCH_SIZE):
+        batch = keys[i:i + DELETE_BATCH_SIZE]
+        try:
+            response = s3_client.delete_objects(
+                Bucket=S3_BUCKET_NAME,
+                # Quiet mode only reports failed keys, not every deleted one
+                Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+            )
+        except Exception as e:
+            print(f"Failed to delete {len(batch)} files: {str(e)}")
+            success = False
+            continue
+
+        for error in response.get('Errors', []):
+            print(f"Failed to delete file {error['Key']}: {error.get('Message')}")
+            success = False
+    return success
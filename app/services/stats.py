@@ -0,0 +1,107 @@
+from sqlmodel import Session, select, update, func
+from sqlalchemy import case
+from datetime import datetime, timedelta, timezone
+from typing import Iterable
+
+from ..models.user import User
+from ..models.submission import Submission
+
+# Constants for streak calculation
+MAX_STREAK_GAP_DAYS = 3  # Maximum allowed gap between active days to maintain streak
+
+def get_current_streak(user: User) -> int:
+    """Stored streak of a user, or 0 if they have not been active within the allowed gap."""
+    if not user.last_submission_date:
+        return 0
+    today = datetime.now(timezone.utc).date()
+    if (today - user.last_submission_date).days > MAX_STREAK_GAP_DAYS:
+        return 0
+    return user.current_streak
+
+def record_submission(session: Session, user_id: int):
+    """Update the stored submission count and streak of a user who just submitted."""
+    today = datetime.now(timezone.utc).date()
+
+    # MySQL applies SET assignments left to right, so the streak has to be
+    # computed before last_submission_date is overwritten
+    session.exec(
+        update(User)
+        .where(User.user_id == user_id)
+        .ordered_values(
+            (User.total_challenges_completed, User.total_challenges_completed + 1),
+            (User.current_streak, case(
+                (User.last_submission_date == today, User.current_streak),
+                (User.last_submission_date >= today - timedelta(days=MAX_STREAK_GAP_DAYS), User.current_streak + 1),
+                else_=1
+            )),
+            (User.last_submission_date, today)
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+def user_stats_subquery(user_ids: Iterable[int]):
+    """Submission count, current streak and last active day per user, computed by the database."""
+    # One row per active day
+    day = func.date(Submission.submitted_at)
+    days = (
+        select(Submission.user_id, day.label("day"), func.count().label("submissions"))
+        .where(Submission.user_id.in_(user_ids))
+        .group_by(Submission.user_id, day)
+        .subquery()
+    )
+
+    # Mark days that follow a gap that is too large, most recent first
+    previous_day = func.lag(days.c.day).over(partition_by=days.c.user_id, order_by=days.c.day.desc())
+    breaks = select(
+        days.c.user_id,
+        days.c.day,
+        days.c.submissions,
+        case((func.datediff(previous_day, days.c.day) > MAX_STREAK_GAP_DAYS, 1), else_=0).label("is_break")
+    ).subquery()
+
+    # Days before the first break belong to the current streak
+    streak_group = func.sum(breaks.c.is_break).over(partition_by=breaks.c.user_id, order_by=breaks.c.day.desc())
+    groups = select(
+        breaks.c.user_id,
+        breaks.c.day,
+        breaks.c.submissions,
+        streak_group.label("streak_group")
+    ).subquery()
+
+    return (
+        select(
+            groups.c.user_id,
+            func.sum(groups.c.submissions).label("total_challenges_completed"),
+            func.sum(case((groups.c.streak_group == 0, 1), else_=0)).label("current_streak"),
+            func.max(groups.c.day).label("last_submission_date")
+        )
+        .group_by(groups.c.user_id)
+        .subquery()
+    )
+
+def refresh_user_stats(session: Session, user_ids: Iterable[int]):
+    """Recompute the stored submission count and streak of users from their remaining submissions."""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+
+    # Reset first, users without any remaining submissions are not in the stats subquery
+    session.exec(
+        update(User)
+        .where(User.user_id.in_(user_ids))
+        .values(total_challenges_completed=0, current_streak=0, last_submission_date=None)
+        .execution_options(synchronize_session=False)
+    )
+
+    # Streaks are stored without checking how recent they are, get_current_streak does that on read
+    stats = user_stats_subquery(user_ids)
+    session.exec(
+        update(User)
+        .where(User.user_id == stats.c.user_id)
+        .values(
+            total_challenges_completed=stats.c.total_challenges_completed,
+            current_streak=stats.c.current_streak,
+            last_submission_date=stats.c.last_submission_date
+        )
+        .execution_options(synchronize_session=False)
+    )
@@ -1,51 +1,41 @@
-from fastapi import BackgroundTasks
 from sqlmodel import Session, select
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
 
-from ..models.challenge import Challenge, ChallengeStatus
+from ..models.challenge import Challenge
 from ..models.challenge_invitation import ChallengeInvitation, InvitationStatus
-from ..models.user import User
+from ..models.device import Device
 from ..services.notification import NotificationService
 
 async def send_ending_soon_notifications(session: Session):
     """Send notifications for challenges ending in 6 hours"""
     notification_service = NotificationService()
-    
-    # Find challenges ending in ~6 hours
-    end_time = datetime.now() + timedelta(hours=6)
-    soon_ending = session.exec(
-        select(Challenge)
+
+    # Find the device tokens of all participants of challenges ending in ~6 hours
+    # in a single query. The creator is included through their automatic accepted invitation.
+    now = datetime.now(timezone.utc)
+    end_time = now + timedelta(hours=6)
+    rows = session.exec(
+        select(Challenge.challenge_id, Challenge.title, Challenge.end_date, Device.fcm_token)
+        .join(ChallengeInvitation, ChallengeInvitation.challenge_id == Challenge.challenge_id)
+        .join(Device, Device.user_id == ChallengeInvitation.receiver_id)
         .where(
-            (Challenge.status == ChallengeStatus.ACTIVE) &
+            (ChallengeInvitation.status == InvitationStatus.ACCEPTED) &
             (Challenge.end_date <= end_time) &
-            (Challenge.end_date > datetime.now())
+            (Challenge.end_date > now) &
+            (Device.fcm_token.is_not(None))
         )
+        .order_by(Challenge.challenge_id)
     ).all()
 
-    for challenge in soon_ending:
-        # Get all participants including creator
-        participants = session.exec(
-            select(User)
-            .where(
-                (User.user_id == challenge.creator_id) |
-                User.user_id.in_(
-                    select(ChallengeInvitation.receiver_id)
-                    .where(
-                        (ChallengeInvitation.challenge_id == challenge.challenge_id) &
-                        (ChallengeInvitation.status == InvitationStatus.ACCEPTED)
-                    )
-                )
-            )
-        ).all()
-
-        hours_left = int((challenge.end_date - datetime.now()).total_seconds() / 3600)
+    for (challenge_id, title, end_date), challenge_rows in groupby(rows, key=lambda row: row[:3]):
+        fcm_tokens = [row.fcm_token for row in challenge_rows]
+        hours_left = int((end_date.replace(tzinfo=timezone.utc) - now).total_seconds() / 3600)
 
-        # Send notifications to all participants
-        for participant in participants:
-            if participant.fcm_token:
-                await notification_service.send_challenge_ending(
-                    fcm_token=participant.fcm_token,
-                    challenge_title=challenge.title,
-                    challenge_id=challenge.challenge_id,
-                    hours_left=hours_left
-                ) 
\ No newline at end of file
+        # Send one multicast to all participants' devices
+        await notification_service.send_challenge_ending(
+            fcm_tokens=fcm_tokens,
+            challenge_title=title,
+            challenge_id=challenge_id,
+            hours_left=hours_left
+        )
@@ -0,0 +1,22 @@
+import sys
+import os
+
+# Add the project root directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlmodel import Session, select
+
+from app.models.user import User
+from app.services.database import engine
+from app.services.stats import refresh_user_stats
+
+def main():
+    # Recompute stored submission stats for every user from their submissions
+    with Session(engine) as session:
+        user_ids = session.exec(select(User.user_id)).all()
+        refresh_user_stats(session, user_ids)
+        session.commit()
+        print(f"Updated submission stats for {len(user_ids)} users")
+
+if __name__ == "__main__":
+    main()
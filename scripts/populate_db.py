@@ -1,23 +1,30 @@
 import sys
 import os
-import uuid
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Project root directory, used for imports and to find the images
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
 
 # Add the project root directory to Python path
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, str(PROJECT_ROOT))
 
-from sqlmodel import Session, create_engine
+from sqlmodel import Session, insert, select
+from botocore.exceptions import ClientError
 from datetime import datetime, timedelta, timezone
 import random
-import hashlib
+import numpy as np
 from app.models.user import User
 from app.models.friend_request import FriendRequest, RequestStatus
 from app.models.friendship import Friendship
 
-from app.config import DATABASE_URL, S3_BUCKET_NAME, S3_URL
-from app.services.database import create_db_and_tables
-from app.services.s3 import s3_client
+from app.config import S3_BUCKET_NAME, S3_URL
+from app.services.database import engine, create_db_and_tables
+from app.services.s3 import s3_client, transfer_config, SHARED_KEY_PREFIX
 
-engine = create_engine(DATABASE_URL)
+# Number of profile pictures uploaded to S3 at the same time
+UPLOAD_WORKERS = 8
 
 # Test data
 test_users = [
@@ -33,111 +40,146 @@ test_users = [
     {"username": "olivia_brown", "display_name": "Olivia Brown", "email": "olivia@example.com", "phone_number": "+1234567899", "profile_picture": "scripts/images/thispersondoesnotexist5.jpg"},
 ]
 
-def create_users(session: Session):
-    users = []
-    # Get the absolute path to the project root directory
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    
+def upload_profile_picture(user_data: dict, image_path: Path):
+    try:
+        with open(image_path, "rb") as image_file:
+            # Key by content, so identical images share one object and
+            # unchanged images uploaded by a previous run are reused. The object can
+            # be shared by many users, so it goes under the prefix the app never deletes.
+            digest = hashlib.file_digest(image_file, "sha256").hexdigest()
+            new_filename = f"{SHARED_KEY_PREFIX}profile-pictures/{digest}.jpg"
+            s3_url = f"{S3_URL}/{new_filename}"
+
+            try:
+                s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=new_filename)
+                user_data["profile_picture"] = s3_url
+                print(f"Profile picture already uploaded to {s3_url}")
+                return
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in ("404", "NoSuchKey", "NotFound"):
+                    raise
+
+            image_file.seek(0)
+            s3_client.upload_fileobj(
+                image_file,
+                S3_BUCKET_NAME,
+                new_filename,
+                ExtraArgs={'ContentType': 'image/jpeg'},
+                Config=transfer_config
+            )
+        user_data["profile_picture"] = s3_url
+        print(f"Successfully uploaded profile picture to {s3_url}")
+    except Exception as e:
+        print(f"Failed to upload profile picture for {user_data['username']}: {str(e)}")
+        user_data["profile_picture"] = None
+
+def create_users(session: Session) -> list[int]:
+    # List the images directory once instead of checking every file separately
+    images_dir = PROJECT_ROOT / "scripts" / "images"
+    available_images = set(os.listdir(images_dir)) if images_dir.is_dir() else set()
+
+    uploads = []
     for user_data in test_users:
         if "profile_picture" in user_data and user_data["profile_picture"]:
-            image_path = os.path.join(base_dir, user_data["profile_picture"])
+            image_path = PROJECT_ROOT / user_data["profile_picture"]
             print(f"Looking for image at: {image_path}")  # Debug print
             
             # Only proceed if the file exists
-            if os.path.exists(image_path):
-                new_filename = f"profile-pictures/{uuid.uuid4()}.jpg"
-                try:
-                    s3_client.upload_file(
-                        image_path,
-                        S3_BUCKET_NAME,
-                        new_filename
-                    )
-                    s3_url = f"{S3_URL}/{new_filename}"
-                    user_data["profile_picture"] = s3_url
-                    print(f"Successfully uploaded profile picture to {s3_url}")
-                except Exception as e:
-                    print(f"Failed to upload profile picture for {user_data['username']}: {str(e)}")
-                    user_data["profile_picture"] = None
+            if image_path.name in available_images:
+                uploads.append((user_data, image_path))
             else:
                 print(f"❌ Profile picture not found for {user_data['username']}: {image_path}")
                 user_data["profile_picture"] = None
 
-        user = User(
-            username=user_data["username"],
-            display_name=user_data["display_name"],
-            email=user_data["email"],
-            phone_number=user_data["phone_number"],
-            profile_picture=user_data["profile_picture"] if "profile_picture" in user_data else None,
-            password=hashlib.sha256("password123".encode()).hexdigest()  # Same password for all test users
-        )
-        users.append(user)
-    
-    session.add_all(users)
-    session.commit()
-    return users
+    # Uploads are independent and network bound, run them concurrently
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+        for upload in uploads:
+            executor.submit(upload_profile_picture, *upload)
+
+    # Insert all users in one executemany with Core instead of per-row ORM inserts
+    user_rows = [
+        {
+            "username": user_data["username"],
+            "display_name": user_data["display_name"],
+            "email": user_data["email"],
+            "phone_number": user_data["phone_number"],
+            "profile_picture": user_data["profile_picture"] if "profile_picture" in user_data else None
+        }
+        for user_data in test_users
+    ]
+    session.exec(insert(User), params=user_rows)
 
-def create_friend_requests(session: Session, users: list[User]):
+    # MySQL has no RETURNING, read the generated IDs back by username
+    user_ids = session.exec(
+        select(User.user_id)
+        .where(User.username.in_([row["username"] for row in user_rows]))
+    ).all()
+    return list(user_ids)
+
+def random_user_pairs(user_ids: list[int], size: int) -> tuple[np.ndarray, np.ndarray]:
+    # Draw all pairs at once. Shifting the second index by 1..n-1 keeps the two
+    # users of a pair distinct without skewing the distribution, so there are
+    # no self-friend requests or self-friendships
+    ids = np.asarray(user_ids)
+    n = len(ids)
+    first = np.random.randint(0, n, size=size)
+    second = (first + np.random.randint(1, n, size=size)) % n
+    return ids[first], ids[second]
+
+def create_friend_requests(session: Session, user_ids: list[int]):
     # Create some random friend requests
-    for _ in range(15):  # Create 15 random friend requests
-        sender = random.choice(users)
-        receiver = random.choice(users)
-        
-        # Avoid self-friend requests by comparing user_ids
-        while sender.user_id == receiver.user_id:
-            receiver = random.choice(users)
-            
+    friend_requests = []
+    now = datetime.now(timezone.utc)
+
+    # Random sent_at times within the last 30 days, drawn all at once
+    days_ago = np.random.randint(0, 31, size=15)  # Create 15 random friend requests
+    senders, receivers = random_user_pairs(user_ids, len(days_ago))
+    for sender_id, receiver_id, days in zip(senders, receivers, days_ago):
         # Random status
         status = random.choice([RequestStatus.PENDING, RequestStatus.ACCEPTED, RequestStatus.REJECTED])
         
-        # Random sent_at time within the last 30 days
-        sent_at = datetime.now(timezone.utc) - timedelta(days=random.randint(0, 30))
-        
-        friend_request = FriendRequest(
-            sender_id=sender.user_id,
-            receiver_id=receiver.user_id,
-            status=status,
-            sent_at=sent_at
-        )
-        session.add(friend_request)
+        friend_requests.append({
+            "sender_id": int(sender_id),
+            "receiver_id": int(receiver_id),
+            "status": status,
+            "sent_at": now - timedelta(days=int(days))
+        })
     
-    session.commit()
+    session.exec(insert(FriendRequest), params=friend_requests)
 
-def create_friendships(session: Session, users: list[User]):
+def create_friendships(session: Session, user_ids: list[int]):
     # Create some random friendships
-    for _ in range(10):  # Create 10 random friendships
-        user1 = random.choice(users)
-        user2 = random.choice(users)
-        
-        # Avoid self-friendships by comparing user_ids
-        while user1.user_id == user2.user_id:
-            user2 = random.choice(users)
-            
-        # Random friendship creation date within the last 60 days
-        since = datetime.now(timezone.utc) - timedelta(days=random.randint(0, 60))
-        
-        friendship = Friendship(
-            user1_id=user1.user_id,
-            user2_id=user2.user_id,
-            since=since
-        )
-        session.add(friendship)
+    friendships = []
+    now = datetime.now(timezone.utc)
+
+    # Random friendship creation dates within the last 60 days, drawn all at once
+    days_ago = np.random.randint(0, 61, size=10)  # Create 10 random friendships
+    users1, users2 = random_user_pairs(user_ids, len(days_ago))
+    for user1_id, user2_id, days in zip(users1, users2, days_ago):
+        friendships.append({
+            "user1_id": int(user1_id),
+            "user2_id": int(user2_id),
+            "since": now - timedelta(days=int(days))
+        })
     
-    session.commit()
+    session.exec(insert(Friendship), params=friendships)
 
 def main():
     create_db_and_tables()
 
-    with Session(engine) as session:
+    # Everything is inserted in one transaction, committed once at the end
+    # or rolled back entirely if any step fails
+    with Session(engine) as session, session.begin():
         # Create users
-        users = create_users(session)
-        print(f"Created {len(users)} users")
+        user_ids = create_users(session)
+        print(f"Created {len(user_ids)} users")
         
         # Create friend requests
-        create_friend_requests(session, users)
+        create_friend_requests(session, user_ids)
         print("Created friend requests")
         
         # Create friendships
-        create_friendships(session, users)
+        create_friendships(session, user_ids)
         print("Created friendships")
 
 if __name__ == "__main__":